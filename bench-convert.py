@@ -0,0 +1,181 @@
+#!/usr/bin/env pypy3
+
+"""
+Benchmarks for convert.py, comparing it with the implementations it
+replaced (kept here as the baselines). Outputs are checked to be identical
+before anything is timed.
+"""
+
+import io
+import random
+from struct import pack
+import sys
+from timeit import timeit
+
+import convert
+
+ROWS = 2000
+RUNS = 5
+
+
+# Baselines
+
+
+def legacy_writeln(name, value):
+    name = name.encode("latin-1", "replace")
+    value = value.encode("latin-1", "replace")
+    return pack(f"!HH{len(name)}s{len(value)}s", len(name), len(value), name, value)
+
+
+def legacy_getHdr(out, name, value):
+    if value is None:
+        return
+    if name == ":url":
+        out.append(legacy_writeln(":origin", convert.url_to_origin(value)))
+    out.append(legacy_writeln(name, value))
+
+
+def legacy_parseOtherHdrs(out, otherValue):
+    if otherValue is None:
+        return
+    otherHeaders = {}
+    lastHeader = None
+    candidates = otherValue.split(",")
+    for candidate in candidates:
+        name, value = legacy_parseCandidate(candidate)
+        if name is None:
+            try:
+                otherHeaders[lastHeader] += value
+            except KeyError:
+                pass  # the original wrote a line to stderr here
+        else:
+            otherHeaders[name] = value
+            lastHeader = name
+    for name, value in otherHeaders.items():
+        out.append(legacy_writeln(name, value))
+
+
+def legacy_parseCandidate(candidate):
+    if " = " in candidate:
+        k, v = candidate.split(" = ", 1)
+        key = k.strip().lower()
+        if key == "":
+            return None, f",{candidate}"
+        else:
+            return key, v.strip()
+    else:
+        return None, f",{candidate}"
+
+
+def legacy_convert(outfile, rows, other):
+    out = []
+    for cursor, row in enumerate(rows, 1):
+        if cursor % convert.TICK == 0:
+            outfile.write(b"".join(out))
+            out = []
+        for name, column in convert.FIELDS:
+            legacy_getHdr(out, name, row[column])
+        if other:
+            legacy_parseOtherHdrs(out, row[23])
+        out.append(legacy_writeln("", ""))
+    outfile.write(b"".join(out))
+
+
+def current_convert(outfile, rows, other):
+    out = convert.Writer(outfile)
+    for row in rows:
+        convert.writeRow(out, row, other)
+    out.flush()
+
+
+# Inputs
+
+
+def other_headers_value(count, rng):
+    "An 'other headers' value with count headers, some with commas in them."
+    headers = []
+    for i in range(count):
+        value = rng.choice(
+            [
+                "1",
+                "max-age=31536000; includeSubDomains",
+                "Accept-Encoding, Origin",
+                "GET, POST, OPTIONS",
+                "session=abc123; Path=/; Expires=Wed, 21 Oct 2020 07:28:00 GMT",
+                "https://example.com",
+            ]
+        )
+        headers.append(f"X-Header-{i} = {value}")
+    return ", ".join(headers)
+
+
+def csv_row(rng):
+    "A parsed CSV row, as parseln returns it."
+    row = [None] * 60
+    row[6] = f"https://www{rng.randrange(1000)}.example.com/path/{rng.random()}.js"
+    row[23] = other_headers_value(rng.randrange(3, 15), rng)
+    for name, column in convert.FIELDS[1:]:
+        if rng.random() < 0.5:
+            row[column] = rng.choice(
+                ["max-age=3600, public", "text/html; charset=utf-8", "gzip", "1234"]
+            )
+    return row
+
+
+def bench(title, unit, baseline, candidate, inputs):
+    if run(baseline, inputs) != run(candidate, inputs):
+        sys.exit(f"* {title}: outputs differ")
+    before = timeit(lambda: run(baseline, inputs), number=RUNS)
+    after = timeit(lambda: run(candidate, inputs), number=RUNS)
+    rate_before = len(inputs) * RUNS / before
+    rate_after = len(inputs) * RUNS / after
+    print(
+        f"* {title}: {rate_before:,.0f} -> {rate_after:,.0f} {unit}/s "
+        + f"({before / after:.2f}x)"
+    )
+
+
+def run(function, inputs):
+    outfile = io.BytesIO()
+    function(outfile, inputs)
+    return outfile.getvalue()
+
+
+def legacy_others(outfile, values):
+    out = []
+    for value in values:
+        legacy_parseOtherHdrs(out, value)
+    outfile.write(b"".join(out))
+
+
+def current_others(outfile, values):
+    out = convert.Writer(outfile)
+    for value in values:
+        convert.parseOtherHdrs(out, value)
+    out.flush()
+
+
+def main():
+    rng = random.Random(1)
+    for count in [5, 20, 60]:
+        values = [other_headers_value(count, rng) for _ in range(ROWS)]
+        bench(
+            f"other headers, {count} per row",
+            "rows",
+            legacy_others,
+            current_others,
+            values,
+        )
+    rows = [csv_row(rng) for _ in range(ROWS * 5)]
+    for other in [False, True]:
+        bench(
+            f"conversion{' with -o' if other else ''}",
+            "rows",
+            lambda outfile, rows: legacy_convert(outfile, rows, other),
+            lambda outfile, rows: current_convert(outfile, rows, other),
+            rows,
+        )
+
+
+if __name__ == "__main__":
+    main()
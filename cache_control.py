@@ -1,21 +1,21 @@
 #!/usr/bin/env pypy3
 
-from collections import defaultdict, Counter
+from collections import Counter
 from decimal import Decimal
 import difflib
 from functools import partial, lru_cache
-from itertools import chain
 from operator import itemgetter
 import sys
 
 
-from header_runner import Runner
+from header_runner import Runner, CountTable, KeyIndex, StreamingTable
 
 CC = b"cache-control"
 
 
 class CacheControl(Runner):
 
+    VERSION = 1  # of aggregates(); bump it when they change (see trend.py)
     INTERESTING = [b"cache-control", b"content-type"]
     DEFINED_DIRECTIVES = [
         "max-age",
@@ -53,8 +53,9 @@ class CacheControl(Runner):
     SHOW_SAMPLES = 5
     SIMILARITY_RATIO = 0.8
 
-    def __init__(self):
+    def __init__(self, by_origin=False):
         Runner.__init__(self)
+        self.by_origin = by_origin
         self.parse_succeed = 0
         self.parse_fail = 0
         self.directive_count = 0
@@ -62,16 +63,20 @@ class CacheControl(Runner):
         self.informal_directives = Counter()
         self.request_directives = Counter()
         self.misspelled_directives = Counter()
-        self.misspelled_samples = defaultdict(lambda: Counter())
-        self.misspelled_directives_by_origin = defaultdict(lambda: Counter())
+        self.misspelled_samples = CountTable()
+        if by_origin:  # input is clustered by origin; see cluster.py
+            by_origin_table = partial(StreamingTable, self.SHOW_SAMPLES)
+        else:
+            by_origin_table = partial(CountTable, KeyIndex())
+        self.misspelled_directives_by_origin = by_origin_table()
         self.other_directives = Counter()
-        self.other_directives_by_origin = defaultdict(lambda: Counter())
+        self.other_directives_by_origin = by_origin_table()
 
-        self.directives_by_origin = defaultdict(lambda: Counter())
+        self.directives_by_origin = by_origin_table()
         self.content_types = Counter()
-        self.directives_by_type = defaultdict(lambda: Counter())
+        self.directives_by_type = CountTable()
         self.total_origins = 0
-        self.directives_by_https = defaultdict(lambda: Counter())
+        self.directives_by_https = CountTable()
 
         self.coincidences = Counter()
         self.without_validator = Counter()
@@ -93,13 +98,32 @@ class CacheControl(Runner):
             self.DEFINED_DIRECTIVES + self.REQUEST_DIRECTIVES + self.INFORMAL_DIRECTIVES
         )
 
+    def on_origin_end(self, origin):
+        self.directives_by_origin.finish()
+        self.misspelled_directives_by_origin.finish()
+        self.other_directives_by_origin.finish()
+
     def analyse(self, raw_headers, parsed_headers, parse_errors):
+        parsed = self.analyse_directives(raw_headers, parsed_headers, parse_errors)
+        if parsed is not None:
+            self.count_maxage(parsed)
+
+    def analyse_batch(self, batch):
+        for raw_headers, parsed_headers, parse_errors in batch.unbatch():
+            self.analyse_directives(raw_headers, parsed_headers, parse_errors)
+        column = batch.columns.get(CC)
+        if column is not None:
+            for parsed, count in zip(column.parsed, column.counts):
+                if parsed is not None:
+                    self.count_maxage(parsed, count)
+
+    def analyse_directives(self, raw_headers, parsed_headers, parse_errors):
         if CC not in raw_headers:
-            return
+            return None
         if CC not in parsed_headers:
             if parse_errors.get(CC, None):
                 self.parse_fail += 1
-            return
+            return None
 
         url = raw_headers.get(b":url", "")
         url_origin = raw_headers.get(b":origin", "http://unknown:80/")
@@ -126,9 +150,9 @@ class CacheControl(Runner):
 
         for directive in parsed:
             self.directive_count += 1
-            self.directives_by_origin[directive][url_origin] += 1
-            self.directives_by_type[content_type][directive] += 1
-            self.directives_by_https[directive][is_https] += 1
+            self.directives_by_origin.add(directive, url_origin)
+            self.directives_by_type.add(content_type, directive)
+            self.directives_by_https.add(directive, is_https)
             if directive in self.DEFINED_DIRECTIVES:
                 self.defined_directives[directive] += 1
             elif directive in self.INFORMAL_DIRECTIVES:
@@ -139,25 +163,28 @@ class CacheControl(Runner):
                 similar_directive = self.find_similar(directive)
                 if similar_directive:
                     self.misspelled_directives[similar_directive] += 1
-                    self.misspelled_samples[similar_directive][directive] += 1
-                    self.misspelled_directives_by_origin[similar_directive][
-                        url_origin
-                    ] += 1
+                    self.misspelled_samples.add(similar_directive, directive)
+                    self.misspelled_directives_by_origin.add(
+                        similar_directive, url_origin
+                    )
                 else:
                     self.other_directives[directive] += 1
-                    self.other_directives_by_origin[directive][url_origin] += 1
+                    self.other_directives_by_origin.add(directive, url_origin)
 
         #            params = parsed[directive][1]
         #            if params:
         #                for param in params:
         #                    self.param_counts[param] += 1
         #
+        return parsed
+
+    def count_maxage(self, parsed, count=1):
         maxage_found = False
         maxage_conflict_found = False
         for directive in self.MAXAGE_DIRECTIVES:
             if directive in parsed:
                 if not maxage_found:
-                    self.maxage_count += 1
+                    self.maxage_count += count
                     maxage_found = True
                 maxage_is_int = False
                 maxage_value = parsed[directive][0]
@@ -165,18 +192,18 @@ class CacheControl(Runner):
                 if isinstance(maxage_value, int):
                     maxage_is_int = True
                     if -self.SMALL <= maxage_value <= self.SMALL:
-                        self.maxage_small[maxage_value] += 1
+                        self.maxage_small[maxage_value] += count
                     elif not -(2 ** 31) <= maxage_value <= 2 ** 31:
-                        self.maxage_overflow += 1
+                        self.maxage_overflow += count
                     if maxage_value < 0:
-                        self.maxage_negative += 1
+                        self.maxage_negative += count
                 elif isinstance(maxage_value, Decimal):
-                    self.maxage_decimal += 1
+                    self.maxage_decimal += count
                 else:
-                    self.maxage_nonnumeric += 1
+                    self.maxage_nonnumeric += count
                     self.maxage_nonnumeric_sample[
                         f"{maxage_value} ({type(maxage_value)})"
-                    ] += 1
+                    ] += count
 
                 if (
                     self.MAXAGE_CLASHES.intersection(parsed)
@@ -184,20 +211,43 @@ class CacheControl(Runner):
                 ):
                     maxage_conflict_found = True
                     if maxage_is_int and maxage_value > 0:
-                        self.maxage_conflicting += 1
+                        self.maxage_conflicting += count
                     else:
-                        self.maxage_clash += 1
+                        self.maxage_clash += count
+
+    def aggregates(self):
+        return {
+            "responses": {"total": self.cursor},
+            "cache-control": {
+                "parsed": self.parse_succeed,
+                "failed": self.parse_fail,
+                "too long": self.too_long,
+                "empty": self.empty,
+            },
+            "defined directives": dict(self.defined_directives),
+            "informal directives": dict(self.informal_directives),
+            "request directives": dict(self.request_directives),
+            "misspelled directives": dict(self.misspelled_directives),
+            "other directives": dict(self.other_directives),
+            "max-age": {
+                "total": self.maxage_count,
+                "overflow": self.maxage_overflow,
+                "decimal": self.maxage_decimal,
+                "negative": self.maxage_negative,
+                "non-numeric": self.maxage_nonnumeric,
+                "clash": self.maxage_clash,
+                "conflicting": self.maxage_conflicting,
+            },
+            "coincidences": dict(self.coincidences),
+            "without validator": dict(self.without_validator),
+        }
 
     def show(self):
         print(f"* Total header sets: {self.cursor:n}")
         self.total_headers, hdr_rate = self.compare(self.parse_fail, self.parse_succeed)
         hdr_digits = len(f"{self.total_headers:n}")
 
-        origins = set()
-        origins.update(
-            chain.from_iterable([v.keys() for v in self.directives_by_origin.values()])
-        )
-        self.total_origins = len(origins)
+        self.total_origins = self.directives_by_origin.column_count()
 
         print(f"* Cache-Control Headers")
         print(f"  {self.total_headers:{hdr_digits}n} Cache-Control headers total")
@@ -362,10 +412,8 @@ class CacheControl(Runner):
                 sample = ", ".join(
                     [
                         f"{sample_cleanup(n)} ({v:n}/{int(v/value*100)}%)"
-                        for n, v in sorted(
-                            samples[name].items(), key=itemgetter(1), reverse=True
-                        )
-                    ][: self.SHOW_SAMPLES]
+                        for n, v in samples[name].most_common(self.SHOW_SAMPLES)
+                    ]
                 )
                 print(f"     {self.padding}{sample}")
         print()
@@ -403,7 +451,7 @@ class CacheControl(Runner):
 
 
 if __name__ == "__main__":
-    checker = CacheControl()
+    checker = CacheControl(by_origin="--by-origin" in sys.argv[2:])
     try:
         checker.run(sys.argv[1])
     except KeyboardInterrupt:
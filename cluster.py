@@ -0,0 +1,140 @@
+#!/usr/bin/env pypy3
+
+"""
+Rewrite a converted headers file (see convert.py) so that each origin's
+responses are contiguous, using an external sort so that memory use is
+bounded by --run-size, not by the size of the file.
+
+Runners that set by_origin (e.g., `cache_control.py FILE --by-origin`) can
+then finish with each origin as they go.
+"""
+
+import gzip
+import heapq
+import locale
+from operator import itemgetter
+import os
+import shutil
+from struct import unpack_from, error as structError
+import sys
+import tempfile
+from time import time
+
+from header_runner import Runner
+
+locale.setlocale(locale.LC_ALL, "")
+
+ORIGIN = b":origin"
+RUN_SIZE = 2 ** 28
+RESPONSE_OVERHEAD = 150  # approximate bytes of Python objects per response
+
+
+def read_responses(headerfile, bufsize):
+    "Yield (origin, records) for each response in a converted file."
+    data = b""
+    start = offset = 0
+    origin = b""
+    while 1:
+        chunk = headerfile.read(bufsize)
+        if not chunk:
+            break
+        data = data[start:] + chunk
+        offset -= start
+        start = 0
+        while 1:
+            try:
+                nameLen, valueLen = unpack_from("!HH", data, offset)
+            except structError:
+                break
+            end = offset + 4 + nameLen + valueLen
+            if end > len(data):
+                break
+            if nameLen == 0:  # end of block
+                yield origin, data[start:end]
+                start = end
+                origin = b""
+            elif nameLen == len(ORIGIN) and data.startswith(ORIGIN, offset + 4):
+                origin = data[offset + 4 + nameLen : end]
+            offset = end
+
+
+def cluster(input_file, output_file, run_size):
+    now = time()
+    TICK = Runner.TICK
+    cursor = 0
+    tempdir = tempfile.mkdtemp(dir=os.path.dirname(output_file) or ".")
+    try:
+        runs = []
+        run = []
+        size = 0
+        with gzip.open(input_file, "rb") as headerfile:
+            for response in read_responses(headerfile, Runner.BUFSIZE):
+                cursor += 1
+                if cursor % TICK == 0:
+                    last = now
+                    now = time()
+                    rate = int(TICK / (now - last))
+                    sys.stderr.write(f"- response {cursor:n} ({rate:n}/s)\n")
+                run.append(response)
+                size += len(response[1]) + RESPONSE_OVERHEAD
+                if size >= run_size:
+                    runs.append(write_run(run, tempdir, len(runs)))
+                    run = []
+                    size = 0
+        if run:
+            runs.append(write_run(run, tempdir, len(runs)))
+        run = None
+        sys.stderr.write(f"- merging {len(runs):n} runs\n")
+        runfiles = [gzip.open(path, "rb") for path in runs]
+        try:
+            merged = heapq.merge(
+                *[read_responses(runfile, 2 ** 20) for runfile in runfiles],
+                key=itemgetter(0),
+            )
+            with gzip.open(output_file, "wb") as outfile:
+                out = []
+                size = 0
+                for origin, records in merged:
+                    out.append(records)
+                    size += len(records)
+                    if size >= 2 ** 20:
+                        outfile.write(b"".join(out))
+                        out = []
+                        size = 0
+                outfile.write(b"".join(out))
+        finally:
+            for runfile in runfiles:
+                runfile.close()
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def write_run(run, tempdir, number):
+    "Sort run by origin (keeping file order within an origin) and save it."
+    run.sort(key=itemgetter(0))
+    path = os.path.join(tempdir, f"run-{number}.gz")
+    with gzip.open(path, "wb", compresslevel=1) as runfile:
+        runfile.write(b"".join([records for origin, records in run]))
+    return path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Sort a converted headers file so each origin is contiguous."
+    )
+    parser.add_argument(
+        "-r",
+        "--run-size",
+        type=int,
+        default=RUN_SIZE,
+        help=f"Bytes of responses to sort in memory at once (default: {RUN_SIZE})",
+    )
+    parser.add_argument("input_file", help="The converted headers file location")
+    parser.add_argument("output_file", help="The desired output file location")
+    args = parser.parse_args()
+    try:
+        cluster(args.input_file, args.output_file, args.run_size)
+    except KeyboardInterrupt:
+        pass
@@ -6,25 +6,54 @@ Convert the HTTP response headers in the CSV request files at:
 ... into an efficient-to-read binary format.
 """
 
+from collections import Counter
 import gzip
 import locale
-from struct import pack
+from struct import Struct
 import sys
 from time import time
 from urllib.parse import urlsplit
 
 TICK = 100000
+FLUSH_SIZE = 2 ** 22
+LENGTHS = Struct("!HH")
+END = LENGTHS.pack(0, 0)
+FIELDS = [  # (field name, CSV column)
+    (":url", 6),
+    ("accept-ranges", 34),
+    ("age", 35),
+    ("cache-control", 36),
+    ("connection", 37),
+    ("content-encoding", 38),
+    ("content-language", 39),
+    ("content-length", 40),
+    ("content-location", 41),
+    ("content-type", 42),
+    ("date", 43),
+    ("etag", 44),
+    ("expires", 45),
+    ("keep-alive", 46),
+    ("last-modified", 47),
+    ("location", 48),
+    ("pragma", 49),
+    ("server", 50),
+    ("transfer-encoding", 51),
+    ("vary", 52),
+    ("via", 53),
+    ("x-powered-by", 54),
+]
+other_stats = Counter()  # problems reconstructing "other" headers
 
 locale.setlocale(locale.LC_ALL, "")
 
 
 def run(args):
     cursor = 0
-    out = []
     now = time()
     other = args.other
     prefix = ""
     with gzip.open(args.output_file, "wb") as outfile:
+        out = Writer(outfile)
         with gzip.open(args.input_file, "rt", newline="", errors="replace") as csvfile:
             for line in csvfile:
                 cursor += 1
@@ -41,33 +70,18 @@ def run(args):
                     delta = now - last
                     rate = int(TICK / delta)
                     sys.stderr.write(f"- row {cursor:n} ({rate:n}/s)\n")
-                    outfile.write(b"".join(out))
-                    out = []
-                getHdr(out, ":url", row[6])
-                getHdr(out, "accept-ranges", row[34])
-                getHdr(out, "age", row[35])
-                getHdr(out, "cache-control", row[36])
-                getHdr(out, "connection", row[37])
-                getHdr(out, "content-encoding", row[38])
-                getHdr(out, "content-language", row[39])
-                getHdr(out, "content-length", row[40])
-                getHdr(out, "content-location", row[41])
-                getHdr(out, "content-type", row[42])
-                getHdr(out, "date", row[43])
-                getHdr(out, "etag", row[44])
-                getHdr(out, "expires", row[45])
-                getHdr(out, "keep-alive", row[46])
-                getHdr(out, "last-modified", row[47])
-                getHdr(out, "location", row[48])
-                getHdr(out, "pragma", row[49])
-                getHdr(out, "server", row[50])
-                getHdr(out, "transfer-encoding", row[51])
-                getHdr(out, "vary", row[52])
-                getHdr(out, "via", row[53])
-                getHdr(out, "x-powered-by", row[54])
-                if other:
-                    parseOtherHdrs(out, row[23])
-                out.append(writeln("", ""))
+                writeRow(out, row, other)
+        out.flush()
+    for problem, count in other_stats.items():
+        sys.stderr.write(f"- {count:n} {problem} in other headers\n")
+
+
+def writeRow(out, row, other):
+    for name, column in FIELDS:
+        getHdr(out, name, row[column])
+    if other:
+        parseOtherHdrs(out, row[23])
+    out.end()
 
 
 def parseln(line):
@@ -106,52 +120,87 @@ def parseln(line):
     return row
 
 
-def writeln(name, value):
-    name = name.encode("latin-1", "replace")
-    value = value.encode("latin-1", "replace")
-    return pack(f"!HH{len(name)}s{len(value)}s", len(name), len(value), name, value)
+class Writer:
+    """
+    Write length-prefixed header records into a reusable buffer, passing it
+    on to outfile whenever it grows past flush_size bytes (at the end of a
+    row). The names in FIELDS are only encoded once.
+    """
+
+    def __init__(self, outfile, flush_size=FLUSH_SIZE):
+        self.outfile = outfile
+        self.flush_size = flush_size
+        self.buffer = bytearray()
+        self.names = {name: name.encode("latin-1") for name, column in FIELDS}
+        self.names[":origin"] = b":origin"
+
+    def write(self, name, value):
+        try:
+            name = self.names[name]
+        except KeyError:
+            name = name.encode("latin-1", "replace")
+        value = value.encode("latin-1", "replace")
+        buffer = self.buffer
+        buffer += LENGTHS.pack(len(name), len(value))
+        buffer += name
+        buffer += value
+
+    def end(self):
+        "End the current row (i.e., header block)."
+        self.buffer += END
+        if len(self.buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        self.outfile.write(self.buffer)
+        del self.buffer[:]
 
 
 def getHdr(out, name, value):
     if value is None:
         return
     if name == ":url":
-        out.append(writeln(":origin", url_to_origin(value)))
-    out.append(writeln(name, value))
+        out.write(":origin", url_to_origin(value))
+    out.write(name, value)
 
 
 def parseOtherHdrs(out, otherValue):
+    """
+    Reconstruct the "other" headers, which are dumped as "name = value"
+    pairs joined by commas (even though values can contain commas, too).
+
+    A comma-separated piece that isn't "name = value" continues the previous
+    header's value; those pieces are collected and joined once, when the
+    next header starts.
+    """
     if otherValue is None:
         return
     otherHeaders = {}
-    lastHeader = None
-    candidates = otherValue.split(",")
-    for candidate in candidates:
-        name, value = parseCandidate(candidate)
+    name = None
+    orphans = 0
+    for piece in otherValue.split(","):
+        if " = " in piece:
+            key, _, value = piece.partition(" = ")
+            key = key.strip().lower()
+            if key:
+                if name is not None:
+                    otherHeaders[name] = (
+                        pieces[0] if len(pieces) == 1 else ",".join(pieces)
+                    )
+                name = key
+                pieces = [value.strip()]
+                continue
         if name is None:
-            try:
-                otherHeaders[lastHeader] += value
-            except KeyError:
-                sys.stderr.write(
-                    f"- LOG PARSE ERROR (other header {lastHeader}): {otherValue}\n"
-                )
+            orphans += 1
         else:
-            otherHeaders[name] = value
-            lastHeader = name
+            pieces.append(piece)
+    if name is not None:
+        otherHeaders[name] = pieces[0] if len(pieces) == 1 else ",".join(pieces)
+    if orphans:
+        other_stats["orphaned fragments"] += orphans
+        other_stats["rows with orphaned fragments"] += 1
     for name, value in otherHeaders.items():
-        out.append(writeln(name, value))
-
-
-def parseCandidate(candidate):
-    if " = " in candidate:
-        k, v = candidate.split(" = ", 1)
-        key = k.strip().lower()
-        if key == "":
-            return None, f",{candidate}"
-        else:
-            return key, v.strip()
-    else:
-        return None, f",{candidate}"
+        out.write(name, value)
 
 
 def url_to_origin(url):
@@ -0,0 +1,206 @@
+#!/usr/bin/env pypy3
+
+"""
+Check that the fast-path parsers in header_runner give exactly the same
+results as http_sfv for every value of the FASTPATH fields in a dump.
+
+With --fuzz N, check N generated values per field instead. They're built
+from the pieces that the fast-path expressions care about, so that many
+are accepted, many only just miss, and many are rejected by http_sfv (for
+which the fast path has to return None).
+"""
+
+from collections import defaultdict, Counter
+import random
+import sys
+
+from http_sfv import structures
+
+from header_runner import Runner, fast_parsers
+
+# value pieces for --fuzz: mostly ones the fast path should take, with odd
+# (but sometimes still valid) ones mixed in
+FUZZ_KEYS = [b"max-age", b"public", b"no-cache", b"a", b"*", b"a_b.c", b"x-1"]
+FUZZ_ODD_KEYS = [b"A", b"1a", b"_a", b"a b", b""]
+FUZZ_TOKENS = [b"gzip", b"text/html", b"Accept-Encoding", b"*", b"a:b", b"x#$%&'+^`|~"]
+FUZZ_NUMBERS = [b"0", b"-1", b"3600", b"123456789012345"]
+FUZZ_ODD_VALUES = [b'"x"', b"?1", b"1.5", b":cHJldGVuZA==:", b"()", b"(a b)", b"-"]
+FUZZ_ODD_VALUES += [b"", b"1234567890123456", b"-a", b"\xe4"]
+FUZZ_COMMAS = [b",", b", "]
+FUZZ_ODD_COMMAS = [b" ,", b",\t", b" , ", b",,", b";"]
+FUZZ_SEMICOLONS = [b";", b"; "]
+FUZZ_ODD_SEMICOLONS = [b";  ", b";\t", b" ;", b";;", b","]
+FUZZ_NOISE = [b" ", b"\t", b"A", b"Z", b"_", b"0", b"=", b",", b";", b"\xe4", b"\x7f"]
+FUZZ_PIECES = FUZZ_KEYS + FUZZ_TOKENS + FUZZ_NUMBERS + FUZZ_ODD_VALUES
+FUZZ_PIECES += FUZZ_COMMAS + FUZZ_ODD_COMMAS + FUZZ_NOISE
+
+
+def pick(rnd, usual, odd):
+    "Choose from usual most of the time, and from odd otherwise."
+    return rnd.choice(usual if rnd.random() < 0.9 else odd)
+
+
+class FastPathCheck(Runner):
+
+    INTERESTING = Runner.FASTPATH
+    SHOW_SAMPLES = 10
+
+    def __init__(self):
+        Runner.__init__(self)
+        self.fast = Counter()
+        self.fallback = Counter()
+        self.rejected = Counter()
+        self.mismatches = defaultdict(Counter)
+
+    def analyse_batch(self, batch):
+        for name, column in batch.columns.items():
+            for value, count in zip(column.values, column.counts):
+                self.check(name, value, count)
+
+    def check(self, name, value, count=1):
+        """
+        Count value, comparing it with http_sfv if the fast path takes it.
+        Returns whether the fast path took it.
+        """
+        structure = self.HEADERMAP[name]
+        try:
+            fast = fast_parsers[structure](value)
+        except Exception as why:
+            fast = None
+            problem = f"fast path raised {why!r}"
+        else:
+            if fast is None:
+                self.fallback[name] += count
+                return False
+            problem = self.compare(structure, value, fast)
+        self.fast[name] += count
+        if problem:
+            self.mismatches[name][(value, problem)] += count
+        return True
+
+    def fuzz(self, count, seed):
+        "Check count generated values for each FASTPATH field."
+        rnd = random.Random(seed)
+        for name in self.FASTPATH:
+            structure = self.HEADERMAP[name]
+            for _ in range(count):
+                self.cursor += 1
+                value = self.fuzz_value(rnd, structure)
+                if not self.check(name, value):
+                    try:
+                        structures[structure]().parse(value)
+                    except ValueError:
+                        self.rejected[name] += 1
+
+    @staticmethod
+    def fuzz_value(rnd, structure):
+        if rnd.random() < 0.2:  # anything goes
+            pieces = rnd.randrange(1, 10)
+            return b"".join(rnd.choice(FUZZ_PIECES) for _ in range(pieces))
+        if structure == "dictionary":
+            members = []
+            for _ in range(rnd.randrange(1, 5)):
+                member = pick(rnd, FUZZ_KEYS, FUZZ_ODD_KEYS)
+                if rnd.random() < 0.6:
+                    member += b"=" + pick(
+                        rnd, FUZZ_NUMBERS + FUZZ_TOKENS, FUZZ_ODD_VALUES
+                    )
+                members.append(member)
+            value = pick(rnd, FUZZ_COMMAS, FUZZ_ODD_COMMAS).join(members)
+        elif structure == "list":
+            members = [
+                pick(rnd, FUZZ_TOKENS, FUZZ_ODD_VALUES)
+                for _ in range(rnd.randrange(1, 5))
+            ]
+            value = pick(rnd, FUZZ_COMMAS, FUZZ_ODD_COMMAS).join(members)
+        else:
+            value = pick(rnd, FUZZ_TOKENS, FUZZ_ODD_VALUES)
+            for _ in range(rnd.randrange(0, 3)):
+                value += pick(rnd, FUZZ_SEMICOLONS, FUZZ_ODD_SEMICOLONS)
+                value += pick(rnd, FUZZ_KEYS, FUZZ_ODD_KEYS)
+                if rnd.random() < 0.6:
+                    value += b"=" + pick(
+                        rnd, FUZZ_NUMBERS + FUZZ_TOKENS, FUZZ_ODD_VALUES
+                    )
+        if rnd.random() < 0.3:
+            value = rnd.choice([b" ", b"  ", b"\t"]) + value
+        if rnd.random() < 0.3:
+            value += rnd.choice([b" ", b"\t", b" \t"])
+        for _ in range(rnd.choice([0, 0, 0, 1, 2])):  # mutate
+            position = rnd.randrange(len(value) + 1)
+            value = value[:position] + rnd.choice(FUZZ_NOISE) + value[position + 1 :]
+        return value
+
+    @staticmethod
+    def compare(structure, value, fast):
+        sf = structures[structure]()
+        try:
+            sf.parse(value)
+        except ValueError as why:
+            return f"http_sfv failed: {why!r}"
+        if type(sf) is not type(fast):
+            return f"type {type(fast).__name__} != {type(sf).__name__}"
+        if repr(sf.to_json()) != repr(fast.to_json()):
+            return f"{fast.to_json()!r} != {sf.to_json()!r}"
+        if str(sf) != str(fast):
+            return f"serialises as {str(fast)!r} != {str(sf)!r}"
+        return None
+
+    def show(self):
+        print(f"* Requests: {self.cursor:n}")
+        for name in self.FASTPATH:
+            fast = self.fast[name]
+            total = fast + self.fallback[name]
+            rate = fast / total if total else 0
+            rejected = ""
+            if name in self.rejected:
+                rejected = f", {self.rejected[name]:n} rejected by http_sfv"
+            print(
+                f"  - {name.decode('ascii')}: {fast:n} / {total:n} fast ({rate:1.3%})"
+                + rejected
+            )
+        print()
+        if not self.mismatches:
+            print("* No mismatches")
+            return
+        for name, mismatches in self.mismatches.items():
+            print(f"* {name.decode('ascii')} mismatches")
+            for (value, problem), count in mismatches.most_common(
+                self.SHOW_SAMPLES
+            ):
+                print(f"  {count}: {value!r} - {problem}")
+            print()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Check the fast-path parsers against http_sfv."
+    )
+    parser.add_argument(
+        "input_file", nargs="?", help="The converted headers file location"
+    )
+    parser.add_argument(
+        "--fuzz",
+        type=int,
+        metavar="N",
+        help="Check N generated values per field instead of a dump",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Random seed for --fuzz (default: 0)"
+    )
+    args = parser.parse_args()
+    if (args.input_file is None) == (args.fuzz is None):
+        parser.error("give either an input file or --fuzz")
+    checker = FastPathCheck()
+    try:
+        if args.fuzz is not None:
+            checker.fuzz(args.fuzz, args.seed)
+        else:
+            checker.run(args.input_file)
+    except KeyboardInterrupt:
+        pass
+    checker.show()
+    if checker.mismatches:
+        sys.exit(1)
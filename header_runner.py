@@ -1,25 +1,69 @@
 #!/usr/bin/env pypy3
 
+from array import array
+from bisect import bisect_left
 import csv
-import functools
 import gzip
+import heapq
 import locale
-from struct import unpack_from, error as structError
+import mmap
+from operator import itemgetter
+import os
+import re
+from struct import Struct, unpack_from, error as structError
 import sys
 from time import time
 
 #from http_sfv import util
 #util.COMPAT = True
 
-from http_sfv import structures, __version__ as sfv_version
+from http_sfv import structures, Item, Token, __version__ as sfv_version
 
 locale.setlocale(locale.LC_ALL, "")
 
+# Uncompressed working copies (see unpack.py): a header block, the records
+# exactly as they are in the converted file, then a sparse index holding the
+# offset of every INDEX_STRIDE-th response. The records and the index each
+# start on a WORKING_ALIGN boundary, so they can be mapped by page.
+WORKING_SUFFIX = ".work"
+WORKING_MAGIC = b"HDRWORK1"
+WORKING_HEADER = Struct("!8sQQQQ")  # magic, responses, data end, index offset/len
+WORKING_ALIGN = 2 ** 16
+INDEX_STRIDE = 2 ** 12
+
+
+def working_copy(filename):
+    "Return the name of the uncompressed working copy for filename."
+    if filename.endswith(".gz"):
+        filename = filename[:-3]
+    return filename + WORKING_SUFFIX
+
+
+def read_index(data):
+    "Return the data end and the response index of a mapped working copy."
+    magic, _, data_end, index_offset, index_len = WORKING_HEADER.unpack_from(data)
+    if magic != WORKING_MAGIC:
+        raise ValueError("Not a working copy")
+    index = array("Q")
+    index.frombytes(data[index_offset : index_offset + index_len * index.itemsize])
+    if sys.byteorder == "little":
+        index.byteswap()
+    return data_end, index
+
 
 class Runner:
 
     INTERESTING = []
     BUFSIZE = 2 ** 29
+    BATCH_SIZE = 2 ** 14
+    FASTPATH = [  # high-volume fields to try the fast-path parsers on first
+        b"cache-control",
+        b"content-type",
+        b"vary",
+        b"content-encoding",
+        b"x-content-type-options",
+    ]
+    HOT_SIZE = 2 ** 15
     TICK = 100000
     HEADERMAP = {  # see https://mnot.github.io/I-D/binary-structured-headers/
         b"accept": "list",
@@ -73,64 +117,318 @@ class Runner:
         self.uninteresting = 0
         self.too_long = 0
         self.empty = 0
+        self.pending = []
+        self.batched = type(self).analyse_batch is not Runner.analyse_batch
+        self.hot = {}
+        self.value_stats = {}
+        self.error_kinds = KeyIndex()
+        self.by_origin = False
+        self.origin = None
+        self.last_origin = None
+        self.pending_origins = []
 
     def run(self, filename):
+        if filename.endswith(WORKING_SUFFIX):
+            return self.run_mapped(filename)
+        working = working_copy(filename)
+        if os.path.exists(working) and os.path.getmtime(
+            working
+        ) >= os.path.getmtime(filename):
+            return self.run_mapped(working)
         # bring some things into the local namespace for a tight loop.
         now = time()
         TICK = self.TICK
         BUFSIZE = self.BUFSIZE
         parseLine = self.parseLine
-        parse = self.parse
-        with gzip.open(filename, "rb") as headerfile:
-            headers = {}
-            data = headerfile.read(BUFSIZE)
-            offset = 0
-            while 1:
-                try:
-                    offset, name, value = parseLine(data, offset)
-                except structError:
-                    data = data[offset:] + headerfile.read(BUFSIZE)
-                    offset = 0
-                    if len(data) == 0:
-                        break
+        collect = self.collect
+        by_origin = self.by_origin
+        try:
+            with gzip.open(filename, "rb") as headerfile:
+                headers = {}
+                data = headerfile.read(BUFSIZE)
+                offset = 0
+                while 1:
+                    try:
+                        offset, name, value = parseLine(data, offset)
+                    except structError:
+                        data = data[offset:] + headerfile.read(BUFSIZE)
+                        offset = 0
+                        if len(data) == 0:
+                            break
+                        else:
+                            continue
+                    if name == b"":  # new block
+                        self.cursor += 1
+                        if self.cursor % TICK == 0:
+                            last = now
+                            now = time()
+                            delta = now - last
+                            rate = int(TICK / delta)
+                            sys.stderr.write(
+                                f"- response {self.cursor:n} ({rate:n}/s)\n"
+                            )
+                        if by_origin and headers.get(b":origin") != self.last_origin:
+                            self.mark_origin(headers.get(b":origin"))
+                        collect(headers)
+                        headers = {}
                     else:
-                        continue
-                if name == b"":  # new block
-                    self.cursor += 1
-                    if self.cursor % TICK == 0:
-                        last = now
-                        now = time()
-                        delta = now - last
-                        rate = int(TICK / delta)
-                        sys.stderr.write(f"- response {self.cursor:n} ({rate:n}/s)\n")
-                    parse(headers)
+                        headers[name] = value
+        finally:
+            self.end_run()
+
+    def run_mapped(self, filename, part=0, parts=1):
+        """
+        Run over an uncompressed working copy, decoding records straight out
+        of the mapping. Giving part / parts restricts the run to that share of
+        the responses, so that several workers can share one copy (and the
+        page cache).
+        """
+        now = time()
+        TICK = self.TICK
+        parseLine = self.parseLine
+        collect = self.collect
+        by_origin = self.by_origin
+        try:
+            with open(filename, "rb") as workfile:
+                with mmap.mmap(
+                    workfile.fileno(), 0, access=mmap.ACCESS_READ
+                ) as data:
+                    data_end, index = read_index(data)
+                    offset = end = data_end
+                    if index:
+                        offset = index[len(index) * part // parts]
+                        if part + 1 < parts:
+                            end = index[len(index) * (part + 1) // parts]
                     headers = {}
-                else:
-                    headers[name] = value
+                    while offset < end:
+                        offset, name, value = parseLine(data, offset)
+                        if name == b"":  # new block
+                            self.cursor += 1
+                            if self.cursor % TICK == 0:
+                                last = now
+                                now = time()
+                                delta = now - last
+                                rate = int(TICK / delta)
+                                sys.stderr.write(
+                                    f"- response {self.cursor:n} ({rate:n}/s)\n"
+                                )
+                            if (
+                                by_origin
+                                and headers.get(b":origin") != self.last_origin
+                            ):
+                                self.mark_origin(headers.get(b":origin"))
+                            collect(headers)
+                            headers = {}
+                        else:
+                            headers[name] = value
+        finally:
+            self.end_run()
+
+    def end_run(self):
+        """
+        Analyse any responses still pending and finish the run. This happens
+        even if the run is interrupted (e.g., by KeyboardInterrupt), so that
+        every response counted in cursor has been analysed.
+        """
+        self.flush()
+        if self.by_origin:
+            self.change_origin(None)
+        self.show_value_stats()
 
     def analyse(self, raw_headers, parsed_headers, parse_errors):
         raise NotImplementedError
 
-    def parse(self, raw_headers):
-        parsed_headers = {}
-        parse_errors = {}
-        for name, value in raw_headers.items():
-            if self.INTERESTING and name not in self.INTERESTING:
-                self.uninteresting += 1
-                continue
+    def analyse_batch(self, batch):
+        """
+        Override this instead of analyse to receive responses BATCH_SIZE at a
+        time, as a Batch of per-field Columns.
+        """
+        raise NotImplementedError
+
+    def on_origin_start(self, origin):
+        """
+        Called before the responses for origin are analysed, when by_origin
+        is set. That needs input sorted by origin (see cluster.py); the run
+        fails with ValueError if it isn't.
+        """
+        pass
+
+    def on_origin_end(self, origin):
+        "Called after the last of origin's responses is analysed."
+        pass
+
+    def mark_origin(self, origin):
+        """
+        Note that the next response collected starts origin's responses. Each
+        origin has to sort after the one before it (as cluster.py leaves
+        them), so that an origin can't reappear after on_origin_end.
+        """
+        last = self.last_origin
+        if last is not None and (origin is None or origin < last):
+            raise ValueError(
+                f"Input isn't sorted by origin ({origin!r} after {last!r}); "
+                + "see cluster.py"
+            )
+        self.last_origin = origin
+        self.pending_origins.append((len(self.pending), origin))
+
+    def change_origin(self, origin):
+        if self.origin is not None:
+            self.on_origin_end(self.origin)
+        self.origin = origin
+        if origin is not None:
+            self.on_origin_start(origin)
+
+    def aggregates(self):
+        """
+        Return the results of a run as {section: {key: count}}, for storing
+        and comparing across dumps (see trend.py). The "responses" section
+        should hold the total number of responses seen.
+        """
+        raise NotImplementedError
+
+    def collect(self, raw_headers):
+        self.pending.append(raw_headers)
+        if len(self.pending) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            responses = self.pending
+            origins = self.pending_origins
+            self.pending = []
+            self.pending_origins = []
+            batch = self.parse_batch(responses)
+            if not origins:
+                self.analyse_parsed(batch)
+                return
+            # batches span origins, so analyse them an origin at a time, to
+            # line the hooks up with analysis.
+            start = 0
+            for row, origin in origins:
+                if row > start:
+                    self.analyse_parsed(batch.slice(start, row))
+                self.change_origin(origin)
+                start = row
+            if start > 0:
+                batch = batch.slice(start, len(batch))
+            self.analyse_parsed(batch)
+
+    def analyse_parsed(self, batch):
+        if self.batched:
+            self.analyse_batch(batch)
+        else:
+            analyse = self.analyse
+            for raw_headers, parsed_headers, parse_errors in batch.unbatch():
+                analyse(raw_headers, parsed_headers, parse_errors)
+
+    def parse_batch(self, responses):
+        size = len(responses)
+        columns = {}
+        interesting = self.INTERESTING
+        for row, raw_headers in enumerate(responses):
+            for name, value in raw_headers.items():
+                if interesting and name not in interesting:
+                    self.uninteresting += 1
+                    continue
+                try:
+                    column = columns[name]
+                except KeyError:
+                    column = columns[name] = Column(name, size)
+                column.add(row, value)
+        for column in columns.values():
+            self.parse_column(column)
+        return Batch(responses, columns)
+
+    def parse_column(self, column):
+        """
+        Parse each distinct value in column once, consulting (and then
+        refreshing) the field's hot cache of results from earlier batches.
+        """
+        name = column.name
+        known = name in self.HEADERMAP
+        parseHeader = self.parseHeader
+        try:
+            hot = self.hot[name]
+        except KeyError:
+            hot = self.hot[name] = {}
+        stats = self.value_stats.get(name)
+        if stats is None:
+            stats = self.value_stats[name] = [0, 0, 0]
+        misses = 0
+        for value, count in zip(column.values, column.counts):
+            parsed = error = None
             if len(value) > 254:
-                self.too_long += 1
-                continue  # we skip oversized headers because they could be truncated
-            if len(value) == 0 or value.isspace():
-                self.empty += 1
-                continue  # we don't consider empty headers to be a problem
-            if name not in self.HEADERMAP:
+                self.too_long += count
+            elif len(value) == 0 or value.isspace():
+                self.empty += count
+            elif known:
+                try:
+                    parsed, error = hot[value]
+                except KeyError:
+                    misses += 1
+                    try:
+                        parsed = parseHeader(name, value)
+                    except ValueError as why:
+                        error = self.fingerprint(why, value)
+                    hot[value] = (parsed, error)
+            column.parsed.append(parsed)
+            column.errors.append(error)
+        stats[0] += sum(column.counts)
+        stats[1] += len(column.values)
+        stats[2] += misses
+        if len(hot) > self.HOT_SIZE:
+            # keep just what this batch used
+            self.hot[name] = {
+                value: (parsed, error)
+                for value, parsed, error in zip(
+                    column.values, column.parsed, column.errors
+                )
+                if parsed is not None or error is not None
+            }
+
+    def fingerprint(self, why, value):
+        """
+        Reduce a parse failure to a compact (error code, offset) fingerprint.
+        The code identifies the type and arguments of the innermost ValueError
+        with a message in the chain of causes (no message is formatted; see
+        error_message). The offset is that of the first byte that can't
+        appear in a Structured Field at all, or -1.
+        """
+        error = why
+        while why is not None:
+            if isinstance(why, ValueError) and why.args:
+                error = why
+            why = why.__cause__
+        match = _NOT_SF.search(value)
+        return (
+            self.error_kinds.lookup((type(error), error.args)),
+            match.start() if match else -1,
+        )
+
+    def error_message(self, fingerprint):
+        "Return the error message for a fingerprint (or its error code)."
+        if isinstance(fingerprint, tuple):
+            fingerprint = fingerprint[0]
+        error_type, args = self.error_kinds.keys[fingerprint]
+        return str(error_type(*args)) or error_type.__name__
+
+    def show_value_stats(self):
+        """
+        Write how repetitive each field's values were to stderr: the share of
+        values that were distinct within their batch, and the share that had
+        to be parsed after consulting the hot cache.
+        """
+        if not self.value_stats:
+            return
+        sys.stderr.write("* Distinct values (per batch / parsed)\n")
+        for name, (total, distinct, parsed) in sorted(self.value_stats.items()):
+            if not total or name not in self.HEADERMAP:
                 continue
-            try:
-                parsed_headers[name] = self.parseHeader(name, value)
-            except ValueError as why:
-                parse_errors[name] = why
-        self.analyse(raw_headers, parsed_headers, parse_errors)
+            sys.stderr.write(
+                f"  - {name.decode('ascii', 'replace')}: {total:n} values, "
+                + f"{distinct / total:1.3%} distinct, {parsed / total:1.3%} parsed\n"
+            )
 
     def parseLine(self, data, offset):
         nameLen, valueLen = unpack_from("!HH", data, offset)
@@ -139,8 +437,489 @@ class Runner:
         offset += nameLen + valueLen
         return offset, name, value
 
-    @functools.lru_cache(maxsize=2 ** 15)
     def parseHeader(self, name, value):
-        sf = structures[self.HEADERMAP[name]]()
+        structure = self.HEADERMAP[name]
+        if name in self.FASTPATH:
+            sf = fast_parsers[structure](value)
+            if sf is not None:
+                return sf
+        sf = structures[structure]()
         sf.parse(value)
         return sf
+
+
+# Fast-path parsers for the simple shapes that most values of the hottest
+# fields take (e.g., "max-age=3600, public" or "text/html; charset=utf-8").
+# Each returns the same structure that http_sfv would, or None if the value
+# isn't one of those shapes -- in which case http_sfv does the real work
+# (including generating any errors).
+
+_TOKEN = rb"[A-Za-z*][A-Za-z0-9:/!#$%&'*+\-.^_`|~]*"
+_KEY = rb"[a-z*][a-z0-9_\-.*]*"
+_INTEGER = rb"-?[0-9]{1,15}"
+_MEMBER = rb"%s(?:=(?:%s|%s))?" % (_KEY, _INTEGER, _TOKEN)
+_SIMPLE_DICTIONARY = re.compile(
+    rb" *%s(?:[ \t]*,[ \t]*%s)*[ \t]*" % (_MEMBER, _MEMBER)
+)
+_SIMPLE_LIST = re.compile(rb" *%s(?:[ \t]*,[ \t]*%s)*[ \t]*" % (_TOKEN, _TOKEN))
+_SIMPLE_ITEM = re.compile(rb" *(%s)((?:; *%s)*) *" % (_TOKEN, _MEMBER))
+_DIGIT_START = set(b"-0123456789")
+_NOT_SF = re.compile(rb"[^\t\x20-\x7e]")
+
+
+def fast_bare_item(value):
+    if value[0] in _DIGIT_START:
+        return int(value)
+    return Token(value.decode("ascii"))
+
+
+def fast_dictionary(value):
+    if _SIMPLE_DICTIONARY.fullmatch(value) is None:
+        return None
+    sf = structures["dictionary"]()
+    for member in value.split(b","):
+        key, equals, member_value = member.strip(b" \t").partition(b"=")
+        sf[key.decode("ascii")] = Item(
+            fast_bare_item(member_value) if equals else True
+        )
+    return sf
+
+
+def fast_list(value):
+    if _SIMPLE_LIST.fullmatch(value) is None:
+        return None
+    sf = structures["list"]()
+    for member in value.split(b","):
+        sf.append(Item(Token(member.strip(b" \t").decode("ascii"))))
+    return sf
+
+
+def fast_item(value):
+    match = _SIMPLE_ITEM.fullmatch(value)
+    if match is None:
+        return None
+    token, params = match.groups()
+    sf = Item(Token(token.decode("ascii")))
+    if params:
+        for param in params.split(b";")[1:]:
+            key, equals, param_value = param.lstrip(b" ").partition(b"=")
+            sf.params[key.decode("ascii")] = (
+                fast_bare_item(param_value) if equals else True
+            )
+    return sf
+
+
+fast_parsers = {"dictionary": fast_dictionary, "list": fast_list, "item": fast_item}
+
+
+class Batch:
+    """
+    A block of responses, with the interesting fields laid out as Columns.
+
+    responses is the list of raw header dictionaries, for any lookups that
+    aren't covered by columns (which is keyed by field name).
+    """
+
+    def __init__(self, responses, columns):
+        self.responses = responses
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.responses)
+
+    def slice(self, start, stop):
+        "Return a Batch of responses start to stop, sharing the parse results."
+        columns = {}
+        for name, column in self.columns.items():
+            if column.present.find(1, start, stop) != -1:
+                columns[name] = column.slice(start, stop)
+        return Batch(self.responses[start:stop], columns)
+
+    def unbatch(self):
+        """
+        Yield (raw_headers, parsed_headers, parse_errors) for each response,
+        as analyse would have seen them.
+        """
+        columns = self.columns
+        for row, raw_headers in enumerate(self.responses):
+            parsed_headers = {}
+            parse_errors = {}
+            for name in raw_headers:
+                column = columns.get(name)
+                if column is None:
+                    continue
+                value_id = column.ids[row]
+                parsed = column.parsed[value_id]
+                if parsed is not None:
+                    parsed_headers[name] = parsed
+                else:
+                    error = column.errors[value_id]
+                    if error is not None:
+                        parse_errors[name] = error
+            yield raw_headers, parsed_headers, parse_errors
+
+
+class Column:
+    """
+    One field's values across a Batch.
+
+    present is a mask of the responses that have the field. ids maps each
+    response to an index into the distinct values seen (-1 if absent); counts,
+    parsed and errors are indexed the same way, with parsed / errors set to
+    None when that value wasn't parsed (or didn't fail).
+    """
+
+    __slots__ = (
+        "name",
+        "present",
+        "ids",
+        "values",
+        "counts",
+        "index",
+        "parsed",
+        "errors",
+    )
+
+    def __init__(self, name, size):
+        self.name = name
+        self.present = bytearray(size)
+        self.ids = array("i", [-1]) * size
+        self.values = []
+        self.counts = []
+        self.index = {}
+        self.parsed = []
+        self.errors = []
+
+    def add(self, row, value):
+        self.present[row] = 1
+        try:
+            value_id = self.index[value]
+            self.counts[value_id] += 1
+        except KeyError:
+            value_id = self.index[value] = len(self.values)
+            self.values.append(value)
+            self.counts.append(1)
+        self.ids[row] = value_id
+
+    def slice(self, start, stop):
+        part = Column(self.name, stop - start)
+        ids = self.ids
+        values = self.values
+        for row in range(start, stop):
+            value_id = ids[row]
+            if value_id >= 0:
+                part.add(row - start, values[value_id])
+        index = self.index
+        part.parsed = [self.parsed[index[value]] for value in part.values]
+        part.errors = [self.errors[index[value]] for value in part.values]
+        return part
+
+
+class KeyIndex:
+    """
+    Assign dense integer ids to keys, in order of first appearance.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.keys = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.ids
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def lookup(self, key):
+        try:
+            return self.ids[key]
+        except KeyError:
+            key_id = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+            return key_id
+
+
+class CountTable:
+    """
+    A two-dimensional table of counts (e.g., directive x origin).
+
+    Row and column keys are mapped to dense integer ids; columns can be shared
+    between tables by passing the same KeyIndex. Each row starts out sparse:
+    an array of counts in the order that its columns were first seen, found
+    through an index of (column id << 32 | position) entries, kept sorted in
+    blocks of up to BLOCK_SIZE so that adding one only moves the rest of its
+    block. Once a row covers more than 1/DENSE_RATIO of the known columns,
+    it's promoted to an array of counts indexed by column id, plus the column
+    ids in first-seen order. Either way, no cell costs a Python object, and
+    ties come out in the same order as they would from a Counter.
+    """
+
+    DENSE_RATIO = 2
+    DENSE_MIN = 256
+    BLOCK_SIZE = 2 ** 10
+    TYPECODE = "I"
+
+    def __init__(self, columns=None):
+        self.rows = KeyIndex()
+        self.columns = columns if columns is not None else KeyIndex()
+        self.cells = []
+        self.blocks = []  # sparse rows
+        self.highest = []  # sparse rows: the highest column id in each block
+        self.order = []  # dense rows
+        self.totals = array("Q")
+
+    def add(self, row, column, count=1):
+        row_id = self.rows.ids.get(row)
+        if row_id is None:
+            row_id = self.rows.lookup(row)
+            self.cells.append(array(self.TYPECODE))
+            self.blocks.append([array("Q")])
+            self.highest.append([0])
+            self.order.append(None)
+            self.totals.append(0)
+        column_id = self.columns.ids.get(column)
+        if column_id is None:
+            column_id = self.columns.lookup(column)
+        cells = self.cells[row_id]
+        self.totals[row_id] += count
+        highest = self.highest[row_id]
+        if highest is None:
+            if column_id >= len(cells):
+                grow = max(column_id + 1, len(self.columns) * 9 // 8) - len(cells)
+                cells.frombytes(bytes(grow * cells.itemsize))
+            if not cells[column_id]:
+                self.order[row_id].append(column_id)
+            cells[column_id] += count
+            return
+        block_id = bisect_left(highest, column_id)
+        if block_id == len(highest):
+            block_id -= 1
+            highest[block_id] = column_id
+        block = self.blocks[row_id][block_id]
+        entry = column_id << 32
+        position = bisect_left(block, entry)
+        if position < len(block) and block[position] >> 32 == column_id:
+            cells[block[position] & 0xFFFFFFFF] += count
+            return
+        block.insert(position, entry | len(cells))
+        cells.append(count)
+        distinct = len(cells)
+        if (
+            distinct > self.DENSE_MIN
+            and distinct * self.DENSE_RATIO > len(self.columns)
+        ):
+            self.densify(row_id)
+        elif len(block) > self.BLOCK_SIZE:
+            half = len(block) // 2
+            self.blocks[row_id].insert(block_id + 1, block[half:])
+            del block[half:]
+            highest.insert(block_id, block[-1] >> 32)
+
+    def densify(self, row_id):
+        counts = self.cells[row_id]
+        order = self.column_ids(row_id)
+        dense = array(self.TYPECODE)
+        dense.frombytes(bytes(len(self.columns) * dense.itemsize))
+        for column_id, count in zip(order, counts):
+            dense[column_id] = count
+        self.cells[row_id] = dense
+        self.order[row_id] = order
+        self.blocks[row_id] = self.highest[row_id] = None
+
+    def column_ids(self, row_id):
+        "Return the row's column ids, in the order first seen."
+        order = self.order[row_id]
+        if order is not None:
+            return order
+        order = array(self.TYPECODE)
+        order.frombytes(bytes(len(self.cells[row_id]) * order.itemsize))
+        for block in self.blocks[row_id]:
+            for entry in block:
+                order[entry & 0xFFFFFFFF] = entry >> 32
+        return order
+
+    def count(self, row_id, column_id):
+        cells = self.cells[row_id]
+        highest = self.highest[row_id]
+        if highest is None:
+            return cells[column_id] if column_id < len(cells) else 0
+        block_id = bisect_left(highest, column_id)
+        if block_id == len(highest):
+            return 0
+        block = self.blocks[row_id][block_id]
+        position = bisect_left(block, column_id << 32)
+        if position < len(block) and block[position] >> 32 == column_id:
+            return cells[block[position] & 0xFFFFFFFF]
+        return 0
+
+    def __getitem__(self, row):
+        return CountRow(self, self.rows.ids.get(row))
+
+    def __contains__(self, row):
+        return row in self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def keys(self):
+        return self.rows.keys
+
+    def items(self):
+        return [(row, CountRow(self, row_id)) for row_id, row in enumerate(self.rows)]
+
+    def values(self):
+        return [CountRow(self, row_id) for row_id in range(len(self.rows))]
+
+    def column_count(self):
+        return len(self.columns)
+
+
+class StreamingTable:
+    """
+    A stand-in for CountTable when columns arrive one at a time (e.g., one
+    origin at a time, from a file sorted by cluster.py). Counts for the
+    current column are kept until it changes or finish() is called; after
+    that, only the number of columns in each row, the row total and the
+    top `keep` columns survive, so memory doesn't grow with the columns.
+    """
+
+    def __init__(self, keep):
+        self.keep = keep
+        self.rows = {}
+        self.columns = 0
+        self.column = None
+        self.current = {}
+
+    def add(self, row, column, count=1):
+        if column != self.column:
+            self.finish()
+            self.column = column
+        self.current[row] = self.current.get(row, 0) + count
+
+    def finish(self):
+        if not self.current:
+            return
+        self.columns += 1
+        for row, count in self.current.items():
+            summary = self.rows.get(row)
+            if summary is None:
+                summary = self.rows[row] = StreamingRow()
+            summary.add(self.column, count, self.keep, self.columns)
+        self.current = {}
+
+    def column_count(self):
+        return self.columns
+
+    def __getitem__(self, row):
+        return self.rows.get(row, EMPTY_ROW)
+
+    def __contains__(self, row):
+        return row in self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class StreamingRow:
+    """
+    The Counter-like view of one StreamingTable row: len() is the number of
+    columns seen, but items() and most_common() only have the top columns.
+    """
+
+    __slots__ = ("distinct", "count", "top")
+
+    def __init__(self):
+        self.distinct = 0
+        self.count = 0
+        self.top = []  # min-heap of (count, -sequence, column)
+
+    def add(self, column, count, keep, sequence):
+        self.distinct += 1
+        self.count += count
+        entry = (count, -sequence, column)
+        if len(self.top) < keep:
+            heapq.heappush(self.top, entry)
+        elif entry > self.top[0]:
+            heapq.heapreplace(self.top, entry)
+
+    def __len__(self):
+        return self.distinct
+
+    def total(self):
+        return self.count
+
+    def items(self):
+        return ((column, count) for count, _, column in self.top)
+
+    def most_common(self, n=None):
+        ranked = sorted(self.top, reverse=True)[:n]
+        return [(column, count) for count, _, column in ranked]
+
+
+EMPTY_ROW = StreamingRow()
+
+
+class CountRow:
+    """
+    A read-only, Counter-like view of one row in a CountTable.
+    """
+
+    __slots__ = ("table", "row_id")
+
+    def __init__(self, table, row_id):
+        self.table = table
+        self.row_id = row_id
+
+    def __len__(self):
+        if self.row_id is None:
+            return 0
+        order = self.table.order[self.row_id]
+        if order is None:
+            return len(self.table.cells[self.row_id])
+        return len(order)
+
+    def __getitem__(self, column):
+        if self.row_id is None:
+            return 0
+        column_id = self.table.columns.ids.get(column)
+        if column_id is None:
+            return 0
+        return self.table.count(self.row_id, column_id)
+
+    def __iter__(self):
+        return (column for column, count in self.items())
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [count for column, count in self.items()]
+
+    def total(self):
+        if self.row_id is None:
+            return 0
+        return self.table.totals[self.row_id]
+
+    def items(self):
+        if self.row_id is None:
+            return iter(())
+        keys = self.table.columns.keys
+        cells = self.table.cells[self.row_id]
+        order = self.table.column_ids(self.row_id)
+        if self.table.order[self.row_id] is None:
+            return ((keys[column_id], count) for column_id, count in zip(order, cells))
+        return ((keys[column_id], cells[column_id]) for column_id in order)
+
+    def most_common(self, n=None):
+        if n is None:
+            return sorted(self.items(), key=itemgetter(1), reverse=True)
+        return heapq.nlargest(n, self.items(), key=itemgetter(1))
@@ -0,0 +1,294 @@
+#!/usr/bin/env pypy3
+
+"""
+Answer ad-hoc counting questions about a converted headers file, e.g.:
+
+  count value of cache-control group by content-type where :origin startswith https
+
+A query is:
+
+  count TARGET [group by TARGET] [where CONDITION [and CONDITION ...]] [limit N]
+
+where TARGET is one of:
+
+  - FIELD: responses that have the field (or, in group by, its raw value)
+  - value of FIELD: the field's raw value
+  - members of FIELD: the members of the parsed field (dictionary keys, list
+    members, or an item's value)
+  - responses: every response (count only)
+
+and CONDITION is "FIELD OP LITERAL" with OP one of =, !=, startswith,
+endswith or contains (tested against the raw value; responses without the
+field don't match), or "FIELD exists" / "FIELD missing".
+
+The query is compiled into a function that only looks up the fields it
+needs, and only parses field values when members are asked for.
+"""
+
+from collections import Counter, namedtuple
+import shlex
+import sys
+
+from http_sfv import Item
+
+from header_runner import Runner
+
+Target = namedtuple("Target", ["kind", "field"])
+Condition = namedtuple("Condition", ["field", "op", "literal"])
+
+MISSING = b"-"
+PARSE_ERROR = "(parse error)"
+OPS = {
+    "=": "{v} != {lit}",
+    "!=": "{v} == {lit}",
+    "startswith": "not {v}.startswith({lit})",
+    "endswith": "not {v}.endswith({lit})",
+    "contains": "{lit} not in {v}",
+}
+
+
+class Query:
+    def __init__(self, text):
+        self.text = text
+        self.count = None
+        self.group = None
+        self.where = []
+        self.limit = 20
+        self.parse(shlex.split(text))
+
+    def parse(self, words):
+        words = list(words)
+        if not words or words.pop(0).lower() != "count":
+            raise ValueError("Query must start with 'count'")
+        self.count = self.parse_target(words, "present")
+        if self.count.kind == "present" and self.count.field == b"responses":
+            self.count = None
+        while words:
+            word = words.pop(0).lower()
+            if word == "group" and words and words[0].lower() == "by":
+                words.pop(0)
+                self.group = self.parse_target(words, "value")
+            elif word == "where":
+                self.where.append(self.parse_condition(words))
+                while words and words[0].lower() == "and":
+                    words.pop(0)
+                    self.where.append(self.parse_condition(words))
+            elif word == "limit" and words:
+                try:
+                    self.limit = int(words.pop(0))
+                except ValueError:
+                    raise ValueError("limit must be a number")
+            else:
+                raise ValueError(f"Unexpected '{word}'")
+
+    @staticmethod
+    def parse_target(words, default_kind):
+        if len(words) >= 3 and words[1].lower() == "of":
+            kind = words.pop(0).lower()
+            words.pop(0)
+            if kind not in ["value", "members"]:
+                raise ValueError(f"Unknown target '{kind} of'")
+        else:
+            kind = default_kind
+        if not words:
+            raise ValueError("Missing field name")
+        return Target(kind, words.pop(0).lower().encode("ascii"))
+
+    @staticmethod
+    def parse_condition(words):
+        if len(words) < 2:
+            raise ValueError("Incomplete condition")
+        field = words.pop(0).lower().encode("ascii")
+        op = words.pop(0).lower()
+        if op in ["exists", "missing"]:
+            return Condition(field, op, None)
+        if op not in OPS:
+            raise ValueError(f"Unknown operator '{op}'")
+        if not words:
+            raise ValueError(f"Missing value for '{op}'")
+        return Condition(field, op, words.pop(0).encode("latin-1"))
+
+    @property
+    def fields(self):
+        "The fields that the query needs to look at."
+        fields = [condition.field for condition in self.where]
+        for target in [self.count, self.group]:
+            if target:
+                fields.append(target.field)
+        return sorted(set(fields))
+
+    @property
+    def needs_parsing(self):
+        return any(t and t.kind == "members" for t in [self.count, self.group])
+
+    def compile(self, counts, members):
+        """
+        Return a function that takes a response's raw headers and counts it
+        (if it matches) in counts, along with its source.
+        """
+        constants = {"counts": counts, "members": members, "MISSING": MISSING}
+        lines = []
+        names = {}
+
+        def constant(value):
+            if isinstance(value, bytes):
+                return repr(value)
+            name = f"k{len(constants)}"
+            constants[name] = value
+            return name
+
+        def lookup(field):
+            if field not in names:
+                names[field] = f"f{len(names)}"
+                lines.append(f"{names[field]} = raw_headers.get({constant(field)})")
+            return names[field]
+
+        for condition in self.where:
+            if condition.op == "exists":
+                lines.append(f"if {lookup(condition.field)} is None: return")
+            elif condition.op == "missing":
+                lines.append(f"if {lookup(condition.field)} is not None: return")
+            else:
+                v = lookup(condition.field)
+                test = OPS[condition.op].format(v=v, lit=constant(condition.literal))
+                lines.append(f"if {v} is None or {test}: return")
+
+        key = []
+        loops = []
+        if self.count:
+            v = lookup(self.count.field)
+            lines.append(f"if {v} is None: return")
+            if self.count.kind == "members":
+                loops.append(f"for c in members({constant(self.count.field)}, {v}):")
+                key.append("c")
+            elif self.count.kind == "value":
+                key.append(v)
+            else:
+                key.append(constant(self.count.field))
+        if self.group:
+            v = lookup(self.group.field)
+            if self.group.kind == "members":
+                loops.append(
+                    f"for g in (members({constant(self.group.field)}, {v}) "
+                    + f"if {v} is not None else (MISSING,)):"
+                )
+                key.append("g")
+            elif self.group.kind == "value":
+                key.append(f"MISSING if {v} is None else {v}")
+            else:
+                key.append(f"{v} is not None")
+        if not key:  # count responses
+            key.append(constant(b"responses"))
+
+        indent = ""
+        for loop in loops:
+            lines.append(indent + loop)
+            indent += "    "
+        lines.append(f"{indent}counts[({', '.join(key)},)] += 1")
+
+        source = "def collect(raw_headers):\n" + "".join(
+            f"    {line}\n" for line in lines
+        )
+        namespace = dict(constants)
+        exec(source, namespace)
+        return namespace["collect"], source
+
+
+class QueryRunner(Runner):
+    def __init__(self, query):
+        Runner.__init__(self)
+        self.query = query
+        self.counts = Counter()
+        self.members_cache = {}
+        self.INTERESTING = query.fields
+        # replace the batching stage entirely; we only touch what we need.
+        self.collect, self.source = query.compile(self.counts, self.members)
+
+    def members(self, name, value):
+        try:
+            return self.members_cache[(name, value)]
+        except KeyError:
+            pass
+        if len(self.members_cache) > self.HOT_SIZE:
+            self.members_cache.clear()
+        result = ()
+        if name in self.HEADERMAP and len(value) <= 254 and not (
+            len(value) == 0 or value.isspace()
+        ):
+            try:
+                parsed = self.parseHeader(name, value)
+            except ValueError:
+                result = (PARSE_ERROR,)
+            else:
+                if isinstance(parsed, Item):
+                    result = (str(parsed.value),)
+                elif hasattr(parsed, "keys"):
+                    result = tuple(parsed.keys())
+                else:
+                    result = tuple(
+                        str(m.value) if isinstance(m, Item) else str(m)
+                        for m in parsed
+                    )
+        self.members_cache[(name, value)] = result
+        return result
+
+    def show(self):
+        limit = self.query.limit
+        print(f"* {self.query.text}")
+        print(f"* Responses: {self.cursor:n}")
+        if not self.query.group:
+            for (value,), count in self.counts.most_common(limit):
+                print(f"  - {count:n} {pretty(value)}")
+            return
+        groups = {}
+        for key, count in self.counts.items():
+            groups.setdefault(key[-1], Counter())[key[:-1]] = count
+        totals = sorted(
+            groups.items(), key=lambda item: sum(item[1].values()), reverse=True
+        )
+        for group, counts in totals[:limit]:
+            print(f"* {pretty(group)} - {sum(counts.values()):n}")
+            if self.query.count:
+                for (value,), count in counts.most_common(limit):
+                    print(f"  - {count:n} {pretty(value)}")
+        print()
+
+
+def pretty(value):
+    if isinstance(value, bytes):
+        return value.decode("latin-1")
+    return str(value)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Count things in a converted headers file.",
+        epilog=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "-e",
+        "--explain",
+        action="store_true",
+        help="Show the fields used and the generated code, then exit",
+    )
+    parser.add_argument("input_file", help="The converted headers file location")
+    parser.add_argument("query", help="The query (quote it)")
+    args = parser.parse_args()
+    try:
+        query = Query(args.query)
+    except ValueError as why:
+        parser.error(str(why))
+    checker = QueryRunner(query)
+    if args.explain:
+        print(f"* Fields: {', '.join(f.decode('ascii') for f in query.fields)}")
+        print(f"* Parsing: {'yes' if query.needs_parsing else 'no'}")
+        print(checker.source)
+        sys.exit(0)
+    try:
+        checker.run(args.input_file)
+    except KeyboardInterrupt:
+        pass
+    checker.show()
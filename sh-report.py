@@ -13,19 +13,36 @@ from header_runner import Runner
 
 
 class SHReport(Runner):
+
+    VERSION = 1  # of aggregates(); bump it when they change (see trend.py)
+
     def __init__(self):
         Runner.__init__(self)
         self.succeed = defaultdict(int)
         self.failure = defaultdict(int)
         self.seen = defaultdict(int)
 
-    def analyse(self, raw_headers, parsed_headers, parse_errors):
-        for name in raw_headers:
-            self.seen[name] += 1
-        for name in parsed_headers:
-            self.succeed[name] += 1
-        for name in parse_errors:
-            self.failure[name] += 1
+    def analyse_batch(self, batch):
+        for name, column in batch.columns.items():
+            self.seen[name] += column.present.count(1)
+            succeed = failure = 0
+            for parsed, error, count in zip(column.parsed, column.errors, column.counts):
+                if parsed is not None:
+                    succeed += count
+                elif error is not None:
+                    failure += count
+            if succeed:
+                self.succeed[name] += succeed
+            if failure:
+                self.failure[name] += failure
+
+    def aggregates(self):
+        return {
+            "responses": {"total": self.cursor},
+            "seen": dict(self.seen),
+            "succeed": dict(self.succeed),
+            "failure": dict(self.failure),
+        }
 
     def show(self):
         allAttempted = list(set(list(self.succeed.keys()) + list(self.failure.keys())))
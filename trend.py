@@ -0,0 +1,177 @@
+#!/usr/bin/env pypy3
+
+"""
+Compare an analyzer's results across several dumps (e.g., monthly HTTP
+Archive conversions).
+
+Each dump is scanned in its own process, and its aggregates are saved in a
+store keyed by the analyzer, its VERSION and a fingerprint of the file, so
+that adding a new dump only scans that one, and changing an analyzer (and
+its VERSION) rescans them all.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+from hashlib import sha256
+import importlib.util
+import locale
+import os
+import pickle
+import sys
+
+locale.setlocale(locale.LC_ALL, "")
+
+ANALYZERS = {
+    "cache-control": ("cache_control.py", "CacheControl"),
+    "sh-report": ("sh-report.py", "SHReport"),
+}
+SAMPLE_SIZE = 2 ** 20
+
+
+def load_analyzer(name):
+    filename, class_name = ANALYZERS[name]
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, class_name)
+
+
+def scan(analyzer_name, filename):
+    analyzer = load_analyzer(analyzer_name)()
+    analyzer.run(filename)
+    return analyzer.aggregates()
+
+
+def fingerprint(filename):
+    """
+    Identify a dump by its size and a hash of its first and last
+    SAMPLE_SIZE bytes; hashing all of a multi-gigabyte file would cost
+    nearly as much as scanning it.
+    """
+    size = os.path.getsize(filename)
+    digest = sha256(str(size).encode("ascii"))
+    with open(filename, "rb") as dump:
+        digest.update(dump.read(SAMPLE_SIZE))
+        dump.seek(max(size - SAMPLE_SIZE, 0))
+        digest.update(dump.read(SAMPLE_SIZE))
+    return digest.hexdigest()[:32]
+
+
+class Store:
+    "Per-dump aggregates, one gzip'd pickle per analyzer and dump."
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, analyzer_name, key):
+        return os.path.join(self.directory, f"{analyzer_name}-{key}.pickle.gz")
+
+    def get(self, analyzer_name, key):
+        try:
+            with gzip.open(self.path(analyzer_name, key), "rb") as entry:
+                return pickle.load(entry)
+        except FileNotFoundError:
+            return None
+
+    def put(self, analyzer_name, key, aggregates):
+        path = self.path(analyzer_name, key)
+        with gzip.open(path + ".tmp", "wb") as entry:
+            pickle.dump(aggregates, entry, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+
+def run(args):
+    store = Store(args.store)
+    version = load_analyzer(args.analyzer).VERSION
+    keys = {
+        filename: f"v{version}-{fingerprint(filename)}" for filename in args.dumps
+    }
+    todo = [
+        filename
+        for filename in args.dumps
+        if store.get(args.analyzer, keys[filename]) is None
+    ]
+    if todo:
+        sys.stderr.write(f"* Scanning {len(todo)} of {len(args.dumps)} dumps\n")
+        with ProcessPoolExecutor(max_workers=args.jobs or len(todo)) as pool:
+            scans = {
+                filename: pool.submit(scan, args.analyzer, filename)
+                for filename in todo
+            }
+            for filename, future in scans.items():
+                store.put(args.analyzer, keys[filename], future.result())
+    labels = [os.path.basename(filename) for filename in args.dumps]
+    results = [store.get(args.analyzer, keys[filename]) for filename in args.dumps]
+    report(labels, results, args.limit)
+
+
+def report(labels, results, limit):
+    totals = [result.get("responses", {}).get("total", 0) for result in results]
+    sections = []
+    for result in results:
+        for section in result:
+            if section != "responses" and section not in sections:
+                sections.append(section)
+    width = max([len(f"{total:n}") for total in totals] + [1]) + 11
+    widths = [max(width, len(label)) for label in labels]
+    print("* Responses")
+    print_row("", labels, widths)
+    print_row("", [f"{total:n}" for total in totals], widths)
+    print()
+    for section in sections:
+        rows = set()
+        for result in results:
+            rows.update(result.get(section, {}).keys())
+        latest = results[-1].get(section, {})
+        rows = sorted(rows, key=lambda row: latest.get(row, 0), reverse=True)
+        extra = f" (top {limit})" if len(rows) > limit else ""
+        print(f"* {section}{extra}")
+        for row in rows[:limit]:
+            cells = []
+            for result, total in zip(results, totals):
+                count = result.get(section, {}).get(row, 0)
+                rate = count / total * 100 if total else 0
+                cells.append(f"{count:n} ({rate:1.3f}%)")
+            print_row(pretty(row), cells, widths)
+        print()
+
+
+def print_row(name, cells, widths):
+    print(f"  {name:<30}" + "".join(f" {c:>{w}}" for c, w in zip(cells, widths)))
+
+
+def pretty(key):
+    if isinstance(key, bytes):
+        return key.decode("ascii", "replace")
+    return str(key)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compare an analyzer's results across converted dumps."
+    )
+    parser.add_argument("analyzer", choices=sorted(ANALYZERS), help="The analyzer")
+    parser.add_argument(
+        "dumps", nargs="+", help="Converted header files, oldest first"
+    )
+    parser.add_argument(
+        "-s",
+        "--store",
+        default="trend-store",
+        help="Where to keep per-dump aggregates (default: trend-store)",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, help="Dumps to scan at once (default: all)"
+    )
+    parser.add_argument(
+        "-l", "--limit", type=int, default=25, help="Rows to show per section"
+    )
+    args = parser.parse_args()
+    try:
+        run(args)
+    except KeyboardInterrupt:
+        pass
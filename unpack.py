@@ -0,0 +1,108 @@
+#!/usr/bin/env pypy3
+
+"""
+Decompress a converted headers file (see convert.py) into an uncompressed,
+page-aligned working copy with a response index, next to the original.
+Runner will use the working copy automatically when it's present and newer
+than the original.
+"""
+
+from array import array
+import gzip
+import locale
+import os
+from struct import unpack_from, error as structError
+import sys
+from time import time
+
+from header_runner import (
+    Runner,
+    working_copy,
+    INDEX_STRIDE,
+    WORKING_ALIGN,
+    WORKING_HEADER,
+    WORKING_MAGIC,
+)
+
+locale.setlocale(locale.LC_ALL, "")
+
+
+def unpack(filename, working):
+    now = time()
+    TICK = Runner.TICK
+    BUFSIZE = Runner.BUFSIZE
+    index = array("Q")
+    responses = 0
+    temp = working + ".tmp"
+    with gzip.open(filename, "rb") as headerfile, open(temp, "wb") as workfile:
+        workfile.write(bytes(WORKING_ALIGN))  # header, filled in at the end
+        position = WORKING_ALIGN  # file offset of data[0]
+        response_start = position
+        data = b""
+        offset = 0
+        while 1:
+            chunk = headerfile.read(BUFSIZE)
+            if not chunk:
+                break
+            workfile.write(chunk)
+            position += offset
+            data = data[offset:] + chunk
+            offset = 0
+            while 1:
+                try:
+                    nameLen, valueLen = unpack_from("!HH", data, offset)
+                except structError:
+                    break
+                end = offset + 4 + nameLen + valueLen
+                if end > len(data):
+                    break
+                offset = end
+                if nameLen == 0:  # end of block
+                    if responses % INDEX_STRIDE == 0:
+                        index.append(response_start)
+                    responses += 1
+                    response_start = position + offset
+                    if responses % TICK == 0:
+                        last = now
+                        now = time()
+                        rate = int(TICK / (now - last))
+                        sys.stderr.write(f"- response {responses:n} ({rate:n}/s)\n")
+        data_end = response_start  # drop any incomplete trailing response
+        index_offset = pad(workfile, position + len(data))
+        if sys.byteorder == "little":
+            index.byteswap()
+        workfile.write(index.tobytes())
+        workfile.seek(0)
+        workfile.write(
+            WORKING_HEADER.pack(
+                WORKING_MAGIC, responses, data_end, index_offset, len(index)
+            )
+        )
+    os.replace(temp, working)
+    sys.stderr.write(f"- {responses:n} responses written to {working}\n")
+
+
+def pad(workfile, position):
+    "Pad workfile to the next WORKING_ALIGN boundary and return that offset."
+    aligned = -(-position // WORKING_ALIGN) * WORKING_ALIGN
+    workfile.write(bytes(aligned - position))
+    return aligned
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Make an uncompressed working copy of a converted headers file."
+    )
+    parser.add_argument("input_file", help="The converted headers file location")
+    parser.add_argument(
+        "output_file",
+        nargs="?",
+        help="The working copy location (default: alongside the input file)",
+    )
+    args = parser.parse_args()
+    try:
+        unpack(args.input_file, args.output_file or working_copy(args.input_file))
+    except KeyboardInterrupt:
+        pass
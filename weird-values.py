@@ -5,7 +5,6 @@ Produce the report in draft-nottingham-binary-structurd-headers
 """
 
 from collections import defaultdict, Counter
-from operator import itemgetter
 import sys
 
 
@@ -13,22 +12,29 @@ from header_runner import Runner
 
 
 class WeirdValues(Runner):
+    SHOW_SAMPLES = 10
+
     def __init__(self, field_name):
         Runner.__init__(self)
         self.field_name = field_name.lower().encode("ascii")
+        self.INTERESTING = [self.field_name]
         self.weird = defaultdict(Counter)
 
-    def analyse(self, raw_headers, parsed_headers, parse_errors):
-        if self.field_name in parse_errors:
-            self.weird[str(parse_errors[self.field_name])][
-                raw_headers[self.field_name].decode("ascii", "replace")
-            ] += 1
+    def analyse_batch(self, batch):
+        column = batch.columns.get(self.field_name)
+        if column is None:
+            return
+        for value, error, count in zip(column.values, column.errors, column.counts):
+            if error is not None:
+                code, offset = error
+                self.weird[code][(value, offset)] += count
 
     def show(self):
-        for error_type in self.weird:
-            print(f"* {error_type}")
-            for error_value, count in self.weird[error_type].most_common()[:10]:
-                print(f"  {count}: {error_value}")
+        for code, values in self.weird.items():
+            print(f"* {self.error_message(code)}")
+            for (value, offset), count in values.most_common(self.SHOW_SAMPLES):
+                where = f" (unexpected byte at {offset})" if offset >= 0 else ""
+                print(f"  {count}: {value.decode('ascii', 'replace')}{where}")
             print()
 
 